@@ -7,48 +7,72 @@ Mêmes fonctionnalités, 10x plus rapide
 import os
 import asyncio
 import logging
-import requests
+import queue
+import re
+import secrets
+import signal
+import time
+import httpx
+from collections import OrderedDict
+from logging.handlers import QueueHandler, QueueListener
 from datetime import datetime, timezone
-from typing import List, Optional
-from dataclasses import dataclass
-from threading import Thread
-from http.server import HTTPServer, BaseHTTPRequestHandler
+from typing import Dict, List, Optional, Tuple
+from dataclasses import dataclass, replace
 
 import openai
-from telegram import Update, BotCommand
-from telegram.ext import Application, CommandHandler, MessageHandler, filters, ContextTypes
-from telegram.constants import ParseMode
-from supabase import create_client, Client
+from aiohttp import web
+from telegram import Update, BotCommand, Message
+from telegram.ext import AIORateLimiter, Application, CommandHandler, MessageHandler, filters, ContextTypes
+from telegram.constants import ChatAction, MessageLimit, ParseMode
+from supabase import acreate_client, AsyncClient
+
+# Boucle libuv si disponible (Linux/macOS), asyncio standard sinon
+try:
+    import uvloop
+except ImportError:
+    uvloop = None
 
 # Configuration
-logging.basicConfig(level=logging.INFO)
+# Logs via une file : les handlers ne font qu'enfiler, l'écriture se fait dans le thread du listener
+log_queue: queue.Queue = queue.Queue(-1)
+logging.basicConfig(level=logging.INFO, handlers=[QueueHandler(log_queue)])
+log_listener = QueueListener(log_queue, logging.StreamHandler())
 logger = logging.getLogger(__name__)
 
-class HealthHandler(BaseHTTPRequestHandler):
-    """Health check server pour Render"""
-    
-    def do_GET(self):
-        """Répondre OK aux health checks"""
-        self.send_response(200)
-        self.send_header('Content-type', 'text/plain')
-        self.end_headers()
-        self.wfile.write(b'Samantha Bot is LIVE!')
-    
-    def log_message(self, format, *args):
-        """Supprimer logs HTTP verbeux"""
-        pass
+# Mots déclenchant une recherche web, compilés en une seule regex
+SEARCH_KEYWORDS = ('recherche', 'trouve', 'cherche', 'actualité', 'news', 'prix')
+SEARCH_TRIGGER = re.compile("|".join(map(re.escape, SEARCH_KEYWORDS)), re.IGNORECASE)
+
+# Les coûts sont des entiers en nanodollars ; conversion en $ pour l'affichage
+NANO_PER_USD = 1_000_000_000
+
+# Tarifs gpt-4o-mini en nanodollars par token (0.15 $ / 0.60 $ le million)
+PROMPT_NANO_PER_TOKEN = 150
+COMPLETION_NANO_PER_TOKEN = 600
 
-def start_health_server():
-    """Lancer serveur health en arrière-plan"""
+async def health(request: web.Request) -> web.Response:
+    """Répondre OK aux health checks"""
+    return web.Response(text='Samantha Bot is LIVE!')
+
+async def start_health_server(bot: Optional["SamanthaBot"] = None) -> Optional[web.AppRunner]:
+    """Lancer serveur health sur la boucle asyncio (pour Render), + webhook Telegram si configuré"""
     port = int(os.getenv('PORT', 8000))
     try:
-        server = HTTPServer(('0.0.0.0', port), HealthHandler)
+        app = web.Application()
+        if bot and bot.config.webhook_url:
+            app.router.add_post(bot.WEBHOOK_PATH, bot.handle_webhook)
+        app.router.add_get('/{tail:.*}', health)
+        # access_log=None : pas de logs HTTP verbeux
+        runner = web.AppRunner(app, access_log=None)
+        await runner.setup()
+        await web.TCPSite(runner, '0.0.0.0', port).start()
         logger.info(f"🏥 Health server démarré sur port {port}")
-        server.serve_forever()
+        return runner
     except Exception as e:
         logger.error(f"❌ Erreur health server: {e}")
+        return None
 
-@dataclass
+@dataclass(frozen=True, slots=True)
 class Config:
     telegram_token: str
     openai_api_key: str
@@ -56,12 +80,64 @@ class Config:
     supabase_key: str
     daily_budget: float = 1.50
     agent_name: str = "Samantha"
+    # URL publique : mode webhook si définie, long polling sinon
+    webhook_url: Optional[str] = None
+    
+    @classmethod
+    def from_env(cls) -> "Config":
+        """Lire et convertir les variables d'environnement, une seule fois au démarrage"""
+        return cls(
+            telegram_token=os.getenv('TELEGRAM_BOT_TOKEN'),
+            openai_api_key=os.getenv('OPENAI_API_KEY'),
+            supabase_url=os.getenv('SUPABASE_URL'),
+            supabase_key=os.getenv('SUPABASE_ANON_KEY'),
+            daily_budget=float(os.getenv('DAILY_BUDGET_USD', '1.50')),
+            agent_name=os.getenv('AGENT_NAME', 'Samantha'),
+            # RENDER_EXTERNAL_URL est fournie automatiquement par Render
+            webhook_url=os.getenv('WEBHOOK_URL') or os.getenv('RENDER_EXTERNAL_URL')
+        )
+    
+    def is_complete(self) -> bool:
+        """Variables obligatoires présentes"""
+        return all((self.telegram_token, self.openai_api_key, self.supabase_url, self.supabase_key))
+
+class TTLCache:
+    """Cache LRU borné dont chaque entrée expire après ttl secondes"""
+    
+    def __init__(self, maxsize: int, ttl: float):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        # clé -> (valeur, expiration monotonic)
+        self._entries: OrderedDict = OrderedDict()
+    
+    def get(self, key, default=None):
+        """Valeur encore valide ou default"""
+        entry = self._entries.get(key)
+        if entry is None:
+            return default
+        if entry[1] <= time.monotonic():
+            del self._entries[key]
+            return default
+        self._entries.move_to_end(key)
+        return entry[0]
+    
+    def put(self, key, value):
+        """Mémoriser une valeur, évincer la plus ancienne si plein"""
+        self._entries[key] = (value, time.monotonic() + self.ttl)
+        self._entries.move_to_end(key)
+        if len(self._entries) > self.maxsize:
+            self._entries.popitem(last=False)
+    
+    def pop(self, key):
+        """Oublier une entrée"""
+        self._entries.pop(key, None)
 
 class SimpleMemory:
     """Mémoire simple mais efficace avec Supabase"""
     
-    def __init__(self, supabase_url: str, supabase_key: str):
-        self.supabase = create_client(supabase_url, supabase_key)
+    def __init__(self, supabase: AsyncClient):
+        self.supabase = supabase
+        self._writes = WriteBuffer(supabase, 'conversations')
         self.init_db()
     
     def init_db(self):
@@ -71,139 +147,246 @@ class SimpleMemory:
         pass
     
     def store_message(self, user_id: str, message: str, is_user: bool = True):
-        """Stocker un message"""
-        try:
-            self.supabase.table('conversations').insert({
-                'user_id': user_id,
-                'message': message,
-                'is_user': is_user
-            }).execute()
-        except Exception as e:
-            logger.error(f"Erreur store_message: {e}")
+        """Stocker un message (insert groupé, voir WriteBuffer)"""
+        self._writes.add({
+            'user_id': user_id,
+            'message': message,
+            'is_user': is_user
+        })
     
-    def get_context(self, user_id: str, limit: int = 10) -> str:
-        """Récupérer le contexte récent"""
+    async def flush(self):
+        """Écrire les messages en attente"""
+        await self._writes.close()
+    
+    async def get_user_context(self, user_id: str, limit: int = 10) -> Tuple[str, Optional[str]]:
+        """Contexte récent (formaté côté SQL) et prompt personnalisé en un seul appel (RPC user_context)"""
         try:
-            response = self.supabase.table('conversations').select('message, is_user').eq('user_id', user_id).order('timestamp', desc=True).limit(limit).execute()
-            
-            messages = []
-            for row in reversed(response.data):
-                speaker = "User" if row['is_user'] else "Samantha"
-                messages.append(f"{speaker}: {row['message']}")
-            
-            return "\n".join(messages)
+            response = await self.supabase.rpc('user_context', {'uid': user_id, 'lim': limit}).execute()
+            row = response.data[0] if response.data else {}
+            return row.get('context') or "", row.get('custom_prompt')
         except Exception as e:
-            logger.error(f"Erreur get_context: {e}")
-            return ""
+            logger.error(f"Erreur get_user_context: {e}")
+            return "", None
     
-    def search_memory(self, user_id: str, query: str) -> List[str]:
+    async def search_memory(self, user_id: str, query: str) -> List[str]:
         """Rechercher dans l'historique"""
         try:
-            response = self.supabase.table('conversations').select('message').eq('user_id', user_id).ilike('message', f'%{query}%').order('timestamp', desc=True).limit(5).execute()
+            response = await self.supabase.table('conversations').select('message').eq('user_id', user_id).ilike('message', f'%{query}%').order('timestamp', desc=True).limit(5).execute()
             return [row['message'] for row in response.data]
         except Exception as e:
             logger.error(f"Erreur search_memory: {e}")
             return []
     
-    def remember(self, user_id: str, key: str, value: str):
+    async def remember(self, user_id: str, key: str, value: str):
         """Stocker info importante"""
         try:
-            # Upsert: update if exists, insert if not
-            self.supabase.table('memory').upsert({'user_id': user_id, 'key': key, 'value': value}).execute()
+            # Upsert en un seul aller-retour (ON CONFLICT sur user_id, key)
+            await self.supabase.table('memory').upsert(
+                {'user_id': user_id, 'key': key, 'value': value},
+                on_conflict='user_id,key',
+            ).execute()
         except Exception as e:
             logger.error(f"Erreur remember: {e}")
-    
-    def get_memory(self, user_id: str, key: str) -> Optional[str]:
-        """Récupérer info stockée"""
-        try:
-            response = self.supabase.table('memory').select('value').eq('user_id', user_id).eq('key', key).execute()
-            return response.data[0]['value'] if response.data else None
-        except Exception as e:
-            logger.error(f"Erreur get_memory: {e}")
-            return None
 
 class SimpleSearch:
     """Recherche web simple avec DuckDuckGo"""
     
-    @staticmethod
-    def search(query: str) -> str:
-        """Recherche rapide DuckDuckGo"""
+    # Durée de vie d'un résultat en cache (secondes)
+    SEARCH_CACHE_TTL = 3600
+    # Au-delà, l'API instant-answer ne répond quasiment jamais : pas d'appel
+    INSTANT_ANSWER_MAX_WORDS = 4
+    WEB_OPERATORS = ('site:', 'filetype:', '"')
+    # Requêtes dont la réponse change vite : jamais servies depuis le cache
+    TIME_SENSITIVE = ('actualité', 'news')
+    
+    def __init__(self, maxsize: int = 1024):
+        # Client async persistant : connexions keep-alive partagées, boucle jamais bloquée
+        self.http = httpx.AsyncClient(
+            timeout=5,
+            limits=httpx.Limits(max_connections=20, max_keepalive_connections=10)
+        )
+        self._cache = TTLCache(maxsize=maxsize, ttl=self.SEARCH_CACHE_TTL)
+        self._inflight: Dict[str, asyncio.Task] = {}
+    
+    def worth_lookup(self, query: str) -> bool:
+        """Requête courte sans opérateur : l'API instant-answer a une chance de répondre"""
+        return len(query.split()) <= self.INSTANT_ANSWER_MAX_WORDS and not any(op in query for op in self.WEB_OPERATORS)
+    
+    async def search(self, query: str) -> str:
+        """Recherche rapide DuckDuckGo (cache TTL borné, requêtes identiques regroupées)"""
+        # Clé normalisée : casse et espaces ignorés
+        key = " ".join(query.casefold().split())
+        fresh = any(word in key for word in self.TIME_SENSITIVE)
+        
+        cached = None if fresh else self._cache.get(key)
+        if cached is not None:
+            return cached
+        
+        # Une seule requête HTTP pour des recherches identiques simultanées
+        task = self._inflight.get(key)
+        if task is None:
+            task = asyncio.create_task(self._fetch(query, None if fresh else key))
+            self._inflight[key] = task
+            task.add_done_callback(lambda _: self._inflight.pop(key, None))
+        return await asyncio.shield(task)
+    
+    async def _fetch(self, query: str, key: Optional[str]) -> str:
+        """Appel DuckDuckGo, seuls les succès sont mis en cache (sous key si fournie)"""
         try:
-            url = f"https://api.duckduckgo.com/?q={query}&format=json&no_html=1"
-            response = requests.get(url, timeout=5)
+            # params= : requête encodée correctement (&, #, espaces, accents)
+            response = await self.http.get(
+                "https://api.duckduckgo.com/",
+                params={'q': query, 'format': 'json', 'no_html': '1'}
+            )
             data = response.json()
-            
-            if data.get('Abstract'):
-                return f"🔍 {data['Abstract'][:300]}..."
-            elif data.get('Definition'):
-                return f"📖 {data['Definition'][:300]}..."
-            else:
-                return f"🌐 Recherche effectuée pour: {query}"
-                
         except Exception as e:
             return f"❌ Erreur de recherche: {str(e)}"
+        
+        if data.get('Abstract'):
+            result = f"🔍 {data['Abstract'][:300]}..."
+        elif data.get('Definition'):
+            result = f"📖 {data['Definition'][:300]}..."
+        else:
+            result = f"🌐 Recherche effectuée pour: {query}"
+        
+        if key is not None:
+            self._cache.put(key, result)
+        return result
+    
+    async def close(self):
+        """Fermer les connexions HTTP"""
+        await self.http.aclose()
 
-class SimpleBudget:
-    """Budget tracking ultra-simple"""
+class WriteBuffer:
+    """Regroupe les inserts d'une table en un seul appel Supabase"""
+    
+    def __init__(self, supabase: AsyncClient, table: str, max_rows: int = 32, interval: float = 0.5):
+        self.supabase = supabase
+        self.table = table
+        self.max_rows = max_rows
+        self.interval = interval
+        self._rows: List[dict] = []
+        self._timer: Optional[asyncio.Task] = None
+        self._tasks: set = set()
+    
+    def _spawn(self, coro) -> asyncio.Task:
+        """Lancer une tâche en gardant une référence jusqu'à la fin"""
+        task = asyncio.create_task(coro)
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+        return task
+    
+    def add(self, row: dict):
+        """Mettre une ligne en attente (flush après interval ou max_rows lignes)"""
+        # Horodatage client : les lignes d'un même batch gardent leur ordre
+        row.setdefault('timestamp', datetime.now(timezone.utc).isoformat())
+        self._rows.append(row)
+        
+        if len(self._rows) >= self.max_rows:
+            self._spawn(self.flush())
+        elif self._timer is None:
+            self._timer = self._spawn(self._flush_later())
     
-    def __init__(self, memory: SimpleMemory, daily_limit: float):
-        self.memory = memory
-        self.daily_limit = daily_limit
+    async def _flush_later(self):
+        """Flush différé"""
+        await asyncio.sleep(self.interval)
+        self._timer = None
+        await self.flush()
     
-    def track_cost(self, user_id: str, cost: float):
-        """Tracker un coût"""
+    async def flush(self):
+        """Envoyer les lignes en attente en un seul insert"""
+        rows, self._rows = self._rows, []
+        if not rows:
+            return
         try:
-            self.memory.supabase.table('budget').insert({
-                'user_id': user_id,
-                'cost': cost
-            }).execute()
+            await self.supabase.table(self.table).insert(rows).execute()
         except Exception as e:
-            logger.error(f"Erreur track_cost: {e}")
+            logger.error(f"Erreur flush {self.table}: {e}")
+    
+    async def close(self):
+        """Vider le buffer avant l'arrêt"""
+        await asyncio.gather(*self._tasks)
+        await self.flush()
+
+class SimpleBudget:
+    """Budget tracking ultra-simple"""
+    
+    # Resynchronisation périodique du compteur local avec budget_daily (secondes)
+    SPENT_CACHE_TTL = 300
+    
+    def __init__(self, supabase: AsyncClient, daily_limit: float):
+        self.supabase = supabase
+        self.daily_limit_nano = round(daily_limit * NANO_PER_USD)
+        self._writes = WriteBuffer(supabase, 'budget')
+        # user_id -> [jour UTC, dépensé en nanodollars] (liste : incrémentée sur place)
+        self._spent_cache = TTLCache(maxsize=10000, ttl=self.SPENT_CACHE_TTL)
+    
+    def track_cost(self, user_id: str, cost_nano: int):
+        """Tracker un coût en nanodollars (insert groupé, voir WriteBuffer)"""
+        self._writes.add({
+            'user_id': user_id,
+            'cost_nano': cost_nano
+        })
+        # Compteur local incrémenté sur place (sans prolonger le TTL) : pas de relecture
+        cached = self._spent_cache.get(user_id)
+        if cached:
+            cached[1] += cost_nano
     
-    def get_daily_spent(self, user_id: str) -> float:
-        """Coût du jour"""
+    async def flush(self):
+        """Écrire les coûts en attente"""
+        await self._writes.close()
+    
+    async def get_daily_spent(self, user_id: str) -> int:
+        """Coût du jour en nanodollars"""
+        # UTC timezone aware
+        today = datetime.now(timezone.utc).strftime('%Y-%m-%d')
+        cached = self._spent_cache.get(user_id)
+        if cached and cached[0] == today:
+            return cached[1]
+        
         try:
-            # UTC timezone aware
-            today = datetime.now(timezone.utc).strftime('%Y-%m-%d')
-            response = self.memory.supabase.table('budget').select('cost').eq('user_id', user_id).gte('timestamp', today).execute()
-            return sum(row['cost'] for row in response.data)
+            # Compteur journalier tenu par trigger (voir budget_daily)
+            response = await self.supabase.rpc('daily_spent', {'uid': user_id, 'day': today}).execute()
+            spent = int(response.data or 0)
+            self._spent_cache.put(user_id, [today, spent])
+            return spent
         except Exception as e:
             logger.error(f"Erreur get_daily_spent: {e}")
             return 0
     
-    def can_spend(self, user_id: str) -> bool:
+    async def can_spend(self, user_id: str) -> bool:
         """Vérifier budget"""
-        return self.get_daily_spent(user_id) < self.daily_limit
+        return await self.get_daily_spent(user_id) < self.daily_limit_nano
 
 class SamanthaBot:
     """Bot Telegram Ultra-Simple"""
     
-    def __init__(self, config: Config):
+    # Délai minimum entre deux éditions du message pendant le streaming
+    # (Telegram limite les edit_message_text à ~1/s par chat)
+    STREAM_EDIT_INTERVAL = 1.0
+    # Route du webhook Telegram sur le serveur HTTP (mode webhook)
+    WEBHOOK_PATH = "/webhook"
+    
+    def __init__(self, config: Config, supabase: AsyncClient):
         self.config = config
-        self.memory = SimpleMemory(config.supabase_url, config.supabase_key)
+        
+        # Un seul client Supabase partagé par mémoire et budget
+        self.supabase = supabase
+        self.memory = SimpleMemory(self.supabase)
         self.search = SimpleSearch()
-        self.budget = SimpleBudget(self.memory, config.daily_budget)
+        self.budget = SimpleBudget(self.supabase, config.daily_budget)
+        self._background_tasks: set = set()
+        # Secret vérifié sur chaque requête webhook (renouvelé à chaque démarrage)
+        self.webhook_secret = secrets.token_urlsafe(32)
         
-        # OpenAI client
-        self.openai_client = openai.OpenAI(api_key=config.openai_api_key)
+        # Prompt système par défaut, construit une seule fois
+        self.default_system_prompt = f"""Tu es {config.agent_name}, assistante IA style startup : no bullshit, full efficiency.
+
+Réponds de manière directe, pragmatique et actionnable. 
+Si tu ne sais pas, dis-le. Propose toujours des solutions concrètes."""
         
-        # Telegram app
-        self.app = Application.builder().token(config.telegram_token).build()
-        self.setup_handlers()
-    
-    def setup_handlers(self):
-        """Setup commandes Telegram"""
-        self.app.add_handler(CommandHandler("start", self.start_command))
-        self.app.add_handler(CommandHandler("help", self.help_command))
-        self.app.add_handler(CommandHandler("search", self.search_command))
-        self.app.add_handler(CommandHandler("remember", self.remember_command))
-        self.app.add_handler(CommandHandler("budget", self.budget_command))
-        self.app.add_handler(CommandHandler("prompt", self.prompt_command))
-        self.app.add_handler(MessageHandler(filters.TEXT & ~filters.COMMAND, self.handle_message))
-    
-    async def start_command(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
-        """Commande /start"""
-        welcome = f"""👋 Salut ! Je suis {self.config.agent_name} !
+        # Textes /start et /help, construits une seule fois
+        self.welcome_text = f"""👋 Salut ! Je suis {config.agent_name} !
 
 🤖 Assistant IA style startup : no bullshit, full efficiency.
 
@@ -215,11 +398,7 @@ class SamanthaBot:
 
 **Prêt à bosser ? Posez votre question !** 🚀"""
         
-        await update.message.reply_text(welcome)
-    
-    async def help_command(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
-        """Commande /help"""
-        help_text = """🤖 **COMMANDES SAMANTHA**
+        self.help_text = """🤖 **COMMANDES SAMANTHA**
 
 💬 **Message normal** - Conversation intelligente
 🔍 `/search [requête]` - Recherche web forcée
@@ -228,9 +407,48 @@ class SamanthaBot:
 🎯 `/prompt [nouveau]` - Changer comportement
 
 **Budget:** {:.2f}€/jour
-**Style:** Startup no bullshit, efficacité max""".format(self.config.daily_budget)
+**Style:** Startup no bullshit, efficacité max""".format(config.daily_budget)
+        
+        # OpenAI client
+        # Timeout explicite : un appel bloqué ne retient pas le handler indéfiniment
+        self.openai_client = openai.AsyncOpenAI(api_key=config.openai_api_key, timeout=30, max_retries=2)
         
-        await update.message.reply_text(help_text)
+        # Telegram app
+        # concurrent_updates : les messages de plusieurs utilisateurs sont traités en parallèle
+        # AIORateLimiter : envois cadencés sous les limites Telegram (30/s, 20/min par groupe),
+        # réessai après un 429 au lieu d'une erreur
+        self.app = (
+            Application.builder()
+            .token(config.telegram_token)
+            .concurrent_updates(True)
+            .rate_limiter(AIORateLimiter(max_retries=2))
+            .build()
+        )
+        self.setup_handlers()
+    
+    @classmethod
+    async def create(cls, config: Config) -> "SamanthaBot":
+        """Construire le bot avec un client Supabase async (création asynchrone)"""
+        supabase = await acreate_client(config.supabase_url, config.supabase_key)
+        return cls(config, supabase)
+    
+    def setup_handlers(self):
+        """Setup commandes Telegram"""
+        self.app.add_handler(CommandHandler("start", self.start_command))
+        self.app.add_handler(CommandHandler("help", self.help_command))
+        self.app.add_handler(CommandHandler("search", self.search_command))
+        self.app.add_handler(CommandHandler("remember", self.remember_command))
+        self.app.add_handler(CommandHandler("budget", self.budget_command))
+        self.app.add_handler(CommandHandler("prompt", self.prompt_command))
+        self.app.add_handler(MessageHandler(filters.TEXT & ~filters.COMMAND, self.handle_message))
+    
+    async def start_command(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
+        """Commande /start"""
+        await update.message.reply_text(self.welcome_text)
+    
+    async def help_command(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
+        """Commande /help"""
+        await update.message.reply_text(self.help_text)
     
     async def search_command(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
         """Commande /search"""
@@ -239,7 +457,7 @@ class SamanthaBot:
             return
         
         query = " ".join(context.args)
-        result = self.search.search(query)
+        result = await self.search.search(query)
         await update.message.reply_text(result)
     
     async def remember_command(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
@@ -253,14 +471,14 @@ class SamanthaBot:
         
         # Stocker avec timestamp comme clé
         key = f"memory_{datetime.now().strftime('%Y%m%d_%H%M')}"
-        self.memory.remember(user_id, key, info)
+        await self.memory.remember(user_id, key, info)
         
         await update.message.reply_text(f"✅ Mémorisé: {info}")
     
     async def budget_command(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
         """Commande /budget"""
         user_id = str(update.effective_user.id)
-        spent = self.budget.get_daily_spent(user_id)
+        spent = await self.budget.get_daily_spent(user_id) / NANO_PER_USD
         remaining = self.config.daily_budget - spent
         
         status = f"""💰 **BUDGET AUJOURD'HUI**
@@ -283,7 +501,7 @@ Restant: ${remaining:.3f}
         new_prompt = " ".join(context.args)
         
         # Stocker le prompt personnalisé
-        self.memory.remember(user_id, "custom_prompt", new_prompt)
+        await self.memory.remember(user_id, "custom_prompt", new_prompt)
         
         await update.message.reply_text(f"✅ Prompt mis à jour: {new_prompt}")
     
@@ -292,59 +510,136 @@ Restant: ${remaining:.3f}
         user_id = str(update.effective_user.id)
         message = update.message.text
         
-        # Vérifier budget
-        if not self.budget.can_spend(user_id):
-            await update.message.reply_text("⛔ Budget quotidien atteint. Reset demain.")
-            return
-        
-        # Stocker message utilisateur
-        self.memory.store_message(user_id, message, True)
+        # Indicateur "écrit..." en arrière-plan : ne retarde pas les lectures
+        self._spawn(self._send_typing(context, update.effective_chat.id))
         
-        # Préparer contexte
-        context_text = self.memory.get_context(user_id, 5)
-        custom_prompt = self.memory.get_memory(user_id, "custom_prompt")
+        # Budget, contexte + prompt (une seule RPC) et recherche web : en parallèle
+        can_spend, (context_text, custom_prompt), search_result = await asyncio.gather(
+            self.budget.can_spend(user_id),
+            self.memory.get_user_context(user_id, 5),
+            self._search_for(message)
+        )
         
         # Prompt système
-        system_prompt = custom_prompt or f"""Tu es {self.config.agent_name}, assistante IA style startup : no bullshit, full efficiency.
-
-Réponds de manière directe, pragmatique et actionnable. 
-Si tu ne sais pas, dis-le. Propose toujours des solutions concrètes."""
+        system_prompt = custom_prompt or self.default_system_prompt
         
-        # Vérifier si recherche nécessaire
-        search_keywords = ['recherche', 'trouve', 'cherche', 'actualité', 'news', 'prix']
-        needs_search = any(word in message.lower() for word in search_keywords)
+        if not can_spend:
+            await update.message.reply_text("⛔ Budget quotidien atteint. Reset demain.")
+            return
         
-        search_result = ""
-        if needs_search:
-            search_result = f"\n\nRécherche web: {self.search.search(message)}"
+        # Stocker message utilisateur (horodaté maintenant, écrit avec le prochain batch)
+        self.memory.store_message(user_id, message, True)
         
         # Appeler OpenAI
         try:
-            response = self.openai_client.chat.completions.create(
+            stream = await self.openai_client.chat.completions.create(
                 model="gpt-4o-mini",
                 messages=[
                     {"role": "system", "content": system_prompt},
                     {"role": "user", "content": f"Contexte récent:\n{context_text}\n\nMessage actuel: {message}{search_result}"}
                 ],
                 max_tokens=500,
-                temperature=0.7
+                temperature=0.7,
+                stream=True,
+                # Dernier chunk : tokens réellement facturés
+                stream_options={"include_usage": True}
             )
             
-            reply = response.choices[0].message.content
-            
-            # Tracker coût (estimation)
-            cost = len(message + reply) * 0.000001  # Estimation grossière
-            self.budget.track_cost(user_id, cost)
-            
-            # Stocker réponse
-            self.memory.store_message(user_id, reply, False)
-            
-            await update.message.reply_text(reply)
+            # Afficher la réponse au fil de l'eau en éditant un seul message
+            parts = []
+            usage = None
+            try:
+                sent = await update.message.reply_text("⏳")
+                start = 0  # début, dans la réponse, du texte affiché par `sent`
+                shown = ""
+                last_edit = time.monotonic()
+                async for chunk in stream:
+                    if chunk.usage:
+                        usage = chunk.usage
+                    if not chunk.choices or not chunk.choices[0].delta.content:
+                        continue
+                    parts.append(chunk.choices[0].delta.content)
+                    if time.monotonic() - last_edit >= self.STREAM_EDIT_INTERVAL:
+                        sent, start, shown = await self._show_stream(update, sent, start, shown, "".join(parts))
+                        last_edit = time.monotonic()
+                
+                reply = "".join(parts)
+                if not reply:
+                    # Flux sans contenu : ne pas laisser le "⏳" affiché
+                    await sent.edit_text("❌ Pas de réponse, réessaie.")
+                elif reply[start:] != shown:
+                    await self._show_stream(update, sent, start, shown, reply)
+            finally:
+                # Tokens déjà facturés par OpenAI : coût et réponse enregistrés même si Telegram échoue
+                reply = "".join(parts)
+                if usage:
+                    cost_nano = usage.prompt_tokens * PROMPT_NANO_PER_TOKEN + usage.completion_tokens * COMPLETION_NANO_PER_TOKEN
+                else:
+                    cost_nano = (len(message) + len(reply)) * 1000  # Estimation grossière : 1e-6 $/caractère
+                self.budget.track_cost(user_id, cost_nano)
+                
+                # Stocker réponse (même batch que le message utilisateur si possible)
+                if reply:
+                    self.memory.store_message(user_id, reply, False)
             
         except Exception as e:
             logger.error(f"Erreur OpenAI: {e}")
             await update.message.reply_text(f"❌ Erreur temporaire: {str(e)}")
     
+    async def _show_stream(self, update: Update, sent: Message, start: int, shown: str, text: str) -> Tuple[Message, int, str]:
+        """Afficher text[start:] dans sent (déjà affiché : shown) ; au-delà de 4096 caractères, continuer dans un nouveau message"""
+        limit = MessageLimit.MAX_TEXT_LENGTH
+        while len(text) - start > limit:
+            # Texte identique à l'affichage : Telegram refuserait l'édition ("message is not modified")
+            if text[start:start + limit] != shown:
+                await sent.edit_text(text[start:start + limit])
+            start += limit
+            sent = await update.message.reply_text("⏳")
+            shown = ""
+        if text[start:] != shown:
+            shown = text[start:]
+            await sent.edit_text(shown)
+        return sent, start, shown
+    
+    async def _send_typing(self, context: ContextTypes.DEFAULT_TYPE, chat_id: int):
+        """Action "typing" (indicative : un échec est seulement loggé)"""
+        try:
+            await context.bot.send_chat_action(chat_id=chat_id, action=ChatAction.TYPING)
+        except Exception as e:
+            logger.warning(f"Erreur send_chat_action: {e}")
+    
+    async def _search_for(self, message: str) -> str:
+        """Bloc recherche web à ajouter au prompt ("" si aucun mot-clé ou aucune recherche faite)"""
+        if SEARCH_TRIGGER.search(message) is None or not self.search.worth_lookup(message):
+            return ""
+        return f"\n\nRécherche web: {await self.search.search(message)}"
+    
+    async def handle_webhook(self, request: web.Request) -> web.Response:
+        """Recevoir une update poussée par Telegram (mode webhook)"""
+        if not secrets.compare_digest(request.headers.get('X-Telegram-Bot-Api-Secret-Token', ''), self.webhook_secret):
+            return web.Response(status=403)
+        # Application arrêtée (ou pas encore démarrée) : plus personne ne lit la file,
+        # 503 pour que Telegram renvoie l'update plus tard au lieu de la perdre
+        if not self.app.running:
+            return web.Response(status=503)
+        # Corps invalide : 400 plutôt qu'une exception (500) côté aiohttp
+        try:
+            data = await request.json()
+        except ValueError:
+            return web.Response(status=400)
+        if not isinstance(data, dict) or 'update_id' not in data:
+            return web.Response(status=400)
+        update = Update.de_json(data, self.app.bot)
+        await self.app.update_queue.put(update)
+        return web.Response()
+    
+    def _spawn(self, coro) -> asyncio.Task:
+        """Tâche de fond gardée en référence jusqu'à la fin (attendue à l'arrêt)"""
+        task = asyncio.create_task(coro)
+        self._background_tasks.add(task)
+        task.add_done_callback(self._background_tasks.discard)
+        return task
+    
     async def run(self):
         """Lancer le bot"""
         logger.info(f"Démarrage {self.config.agent_name}...")
@@ -363,18 +658,31 @@ Si tu ne sais pas, dis-le. Propose toujours des solutions concrètes."""
         # Démarrer
         await self.app.initialize()
         await self.app.start()
-        await self.app.updater.start_polling()
+        if self.config.webhook_url:
+            # Telegram pousse les updates sur le serveur HTTP : plus de getUpdates
+            await self.app.bot.set_webhook(
+                url=self.config.webhook_url.rstrip('/') + self.WEBHOOK_PATH,
+                secret_token=self.webhook_secret,
+                allowed_updates=Update.ALL_TYPES
+            )
+        else:
+            await self.app.updater.start_polling()
         
-        logger.info(f"✅ {self.config.agent_name} est LIVE !")
+        logger.info(f"✅ {self.config.agent_name} est LIVE ({'webhook' if self.config.webhook_url else 'polling'}) !")
         
         # Maintenir en vie
         try:
             await asyncio.Future()  # Run forever
-        except KeyboardInterrupt:
+        except (KeyboardInterrupt, asyncio.CancelledError):
             logger.info("Arrêt du bot...")
         finally:
-            await self.app.updater.stop()
+            if self.app.updater.running:
+                await self.app.updater.stop()
             await self.app.stop()
+            await asyncio.gather(*self._background_tasks)
+            await self.memory.flush()
+            await self.budget.flush()
+            await self.search.close()
             await self.app.shutdown()
 
 async def main():
@@ -382,29 +690,39 @@ async def main():
     from dotenv import load_dotenv
     load_dotenv()
     
-    # Démarrer health server en arrière-plan (pour Render)
-    health_thread = Thread(target=start_health_server, daemon=True)
-    health_thread.start()
-    logger.info("🏥 Health server thread démarré")
-    
     # Configuration
-    config = Config(
-        telegram_token=os.getenv('TELEGRAM_BOT_TOKEN'),
-        openai_api_key=os.getenv('OPENAI_API_KEY'),
-        supabase_url=os.getenv('SUPABASE_URL'),
-        supabase_key=os.getenv('SUPABASE_ANON_KEY'),
-        daily_budget=float(os.getenv('DAILY_BUDGET_USD', '1.50')),
-        agent_name=os.getenv('AGENT_NAME', 'Samantha')
-    )
+    config = Config.from_env()
     
     # Validation
-    if not config.telegram_token or not config.openai_api_key or not config.supabase_url or not config.supabase_key:
+    if not config.is_complete():
         logger.error("❌ Variables TELEGRAM_BOT_TOKEN, OPENAI_API_KEY, SUPABASE_URL et SUPABASE_ANON_KEY requises")
         return
     
-    # Lancer bot
-    bot = SamanthaBot(config)
-    await bot.run()
+    # Lancer bot ; health server (+ webhook) sur la même boucle (pour Render)
+    bot = await SamanthaBot.create(config)
+    health_runner = await start_health_server(bot)
+    if health_runner is None and config.webhook_url:
+        # Sans serveur HTTP, Telegram pousserait les updates dans le vide
+        logger.warning("⚠️ Serveur HTTP indisponible : webhook désactivé, repli sur le polling")
+        bot.config = replace(config, webhook_url=None)
+    
+    # SIGTERM (arrêt Render) : annuler la tâche principale pour passer par le flush de run()
+    try:
+        asyncio.get_running_loop().add_signal_handler(signal.SIGTERM, asyncio.current_task().cancel)
+    except NotImplementedError:
+        pass  # Windows : pas de signal handler sur la boucle
+    try:
+        await bot.run()
+    finally:
+        if health_runner:
+            await health_runner.cleanup()
 
 if __name__ == "__main__":
-    asyncio.run(main())
\ No newline at end of file
+    log_listener.start()
+    try:
+        if uvloop:
+            uvloop.run(main())
+        else:
+            asyncio.run(main())
+    finally:
+        log_listener.stop()
\ No newline at end of file
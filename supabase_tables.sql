@@ -20,17 +20,80 @@ CREATE TABLE IF NOT EXISTS memory (
     UNIQUE(user_id, key)
 );
 
--- Table budget
+-- Table budget (coûts en nanodollars entiers : sommes exactes)
 CREATE TABLE IF NOT EXISTS budget (
     id BIGSERIAL PRIMARY KEY,
     user_id TEXT NOT NULL,
-    cost REAL NOT NULL,
+    cost_nano BIGINT NOT NULL,
     timestamp TIMESTAMPTZ DEFAULT NOW()
 );
 
+-- Migration : ancienne colonne cost REAL (dollars) -> cost_nano
+DO $$
+BEGIN
+    IF EXISTS (SELECT 1 FROM information_schema.columns WHERE table_name = 'budget' AND column_name = 'cost') THEN
+        ALTER TABLE budget ADD COLUMN IF NOT EXISTS cost_nano BIGINT;
+        UPDATE budget SET cost_nano = ROUND(cost::NUMERIC * 1000000000) WHERE cost_nano IS NULL;
+        ALTER TABLE budget ALTER COLUMN cost_nano SET NOT NULL;
+        ALTER TABLE budget DROP COLUMN cost;
+        DROP TABLE IF EXISTS budget_daily;
+    END IF;
+END $$;
+
 -- Index pour performance
-CREATE INDEX IF NOT EXISTS idx_conversations_user_id ON conversations(user_id);
+DROP INDEX IF EXISTS idx_conversations_user_id;
+CREATE INDEX IF NOT EXISTS idx_conversations_user_ts ON conversations(user_id, timestamp DESC);
 CREATE INDEX IF NOT EXISTS idx_conversations_timestamp ON conversations(timestamp);
 CREATE INDEX IF NOT EXISTS idx_memory_user_id ON memory(user_id);
-CREATE INDEX IF NOT EXISTS idx_budget_user_id ON budget(user_id);
-CREATE INDEX IF NOT EXISTS idx_budget_timestamp ON budget(timestamp);
\ No newline at end of file
+DROP INDEX IF EXISTS idx_budget_user_id;
+CREATE INDEX IF NOT EXISTS idx_budget_user_ts ON budget(user_id, timestamp DESC);
+CREATE INDEX IF NOT EXISTS idx_budget_timestamp ON budget(timestamp);
+
+-- Compteurs journaliers : budget reste le journal, budget_daily sert les lectures
+CREATE TABLE IF NOT EXISTS budget_daily (
+    user_id TEXT NOT NULL,
+    day DATE NOT NULL,
+    spent_nano BIGINT NOT NULL DEFAULT 0,
+    PRIMARY KEY (user_id, day)
+);
+
+CREATE OR REPLACE FUNCTION budget_daily_add() RETURNS TRIGGER AS $$
+BEGIN
+    INSERT INTO budget_daily (user_id, day, spent_nano)
+    VALUES (NEW.user_id, (NEW.timestamp AT TIME ZONE 'UTC')::DATE, NEW.cost_nano)
+    ON CONFLICT (user_id, day) DO UPDATE SET spent_nano = budget_daily.spent_nano + EXCLUDED.spent_nano;
+    RETURN NEW;
+END;
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS trg_budget_daily ON budget;
+CREATE TRIGGER trg_budget_daily AFTER INSERT ON budget
+    FOR EACH ROW EXECUTE FUNCTION budget_daily_add();
+
+-- Reprise de l'historique existant (sans effet si déjà fait)
+INSERT INTO budget_daily (user_id, day, spent_nano)
+SELECT user_id, (timestamp AT TIME ZONE 'UTC')::DATE, SUM(cost_nano) FROM budget GROUP BY 1, 2
+ON CONFLICT (user_id, day) DO NOTHING;
+
+-- Dépense d'un utilisateur pour un jour (UTC) : une lecture par clé primaire
+DROP FUNCTION IF EXISTS daily_spent(TEXT, DATE);
+CREATE FUNCTION daily_spent(uid TEXT, day DATE)
+RETURNS BIGINT AS $$
+    SELECT COALESCE((SELECT spent_nano FROM budget_daily WHERE user_id = uid AND budget_daily.day = daily_spent.day), 0);
+$$ LANGUAGE sql STABLE;
+
+-- Contexte récent (déjà formaté) + prompt personnalisé en un seul appel (avant chaque réponse)
+DROP FUNCTION IF EXISTS user_context(TEXT, INT);
+CREATE FUNCTION user_context(uid TEXT, lim INT)
+RETURNS TABLE (context TEXT, custom_prompt TEXT) AS $$
+    SELECT
+        (SELECT COALESCE(string_agg(CASE WHEN c.is_user THEN 'User: ' ELSE 'Samantha: ' END || c.message, E'\n' ORDER BY c.timestamp), '')
+         FROM (SELECT message, is_user, timestamp FROM conversations
+               WHERE user_id = uid ORDER BY timestamp DESC LIMIT lim) c),
+        (SELECT value FROM memory WHERE user_id = uid AND key = 'custom_prompt');
+$$ LANGUAGE sql STABLE;
+
+-- Rétention : purge quotidienne (03:00 UTC) des conversations de plus de 90 jours
+-- (pg_cron, disponible sur Supabase ; cron.schedule remplace le job du même nom)
+CREATE EXTENSION IF NOT EXISTS pg_cron;
+SELECT cron.schedule('purge_conversations', '0 3 * * *', $$DELETE FROM conversations WHERE timestamp < now() - interval '90 days'$$);
\ No newline at end of file